@@ -4,37 +4,90 @@ Handles email signup for the waiting list.
 """
 
 import json
+import logging
 import os
 import re
-import uuid
-from datetime import datetime
+import secrets
+from datetime import datetime, timezone
 
 import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+# orjson is used when the runtime provides it (e.g. through a Lambda layer); the
+# deployment zip only bundles this file, so fall back to the stdlib json module.
+try:
+    import orjson
+
+    def json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+except ImportError:
+    json_dumps = json.dumps
+    json_loads = json.loads
+
 # Configuration
 WAITLIST_TABLE = os.environ.get("WAITLIST_TABLE", "terraperf-landing-waitlist-prod")
-CORS_ORIGINS = os.environ.get("CORS_ORIGINS", "https://terraperf.com,https://www.terraperf.com").split(",")
+# Ordered: the first origin is the default when the request origin is not allowed
+CORS_ORIGINS = tuple(os.environ.get("CORS_ORIGINS", "https://terraperf.com,https://www.terraperf.com").split(","))
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
-dynamodb = boto3.resource("dynamodb")
+# Created once per execution environment so warm invocations reuse the pooled,
+# kept-alive HTTPS connection instead of paying a new TLS handshake per call.
+BOTO_CONFIG = Config(
+    tcp_keepalive=True,
+    retries={"max_attempts": 3, "mode": "standard"},
+    max_pool_connections=10,
+)
+
+dynamodb = boto3.resource("dynamodb", config=BOTO_CONFIG)
 table = dynamodb.Table(WAITLIST_TABLE)
 
+# Atomic counter item holding the subscriber count, so stats never need a Scan
+STATS_KEY = {"email": "STATS#waitlist"}
+# Set once this execution environment has seen (or seeded) the counter item
+_counter_ready = False
+
+# GSI (source, created_at) for per-source analytics; the counter item is not indexed
+SOURCE_INDEX = "source-created_at-index"
+DEFAULT_SOURCE = "landing_page"
+MAX_SOURCE_LENGTH = 64  # GSI partition keys are capped at 2048 bytes
+
+MAX_EMAIL_LENGTH = 254
+MAX_BODY_SIZE = 4096  # A signup body is well under 1KB; reject anything larger before parsing
+
 # Email validation regex
 EMAIL_REGEX = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
 
 
-def get_cors_headers(origin: str = None) -> dict:
-    """Get CORS headers for response."""
-    allowed_origin = CORS_ORIGINS[0]  # Default
-    if origin and origin in CORS_ORIGINS:
-        allowed_origin = origin
-
-    return {
+# Response headers for each allowed origin, built once at import time.
+# These dicts are shared across responses and must not be mutated.
+_HEADERS_BY_ORIGIN = {
+    allowed_origin: {
         "Access-Control-Allow-Origin": allowed_origin,
         "Access-Control-Allow-Methods": "GET, POST, DELETE, OPTIONS",
         "Access-Control-Allow-Headers": "Content-Type, Authorization",
         "Content-Type": "application/json"
     }
+    for allowed_origin in CORS_ORIGINS
+}
+_DEFAULT_HEADERS = _HEADERS_BY_ORIGIN[CORS_ORIGINS[0]]
+
+# Preflight responses additionally let the browser cache the result for 24h
+_PREFLIGHT_HEADERS_BY_ORIGIN = {
+    allowed_origin: {**headers, "Access-Control-Max-Age": "86400"}
+    for allowed_origin, headers in _HEADERS_BY_ORIGIN.items()
+}
+_DEFAULT_PREFLIGHT_HEADERS = _PREFLIGHT_HEADERS_BY_ORIGIN[CORS_ORIGINS[0]]
+
+
+def get_cors_headers(origin: str = None) -> dict:
+    """Get CORS headers for response (shared dict, do not mutate)."""
+    return _HEADERS_BY_ORIGIN.get(origin, _DEFAULT_HEADERS)
 
 
 def response(status_code: int, body: dict, origin: str = None) -> dict:
@@ -42,7 +95,7 @@ def response(status_code: int, body: dict, origin: str = None) -> dict:
     return {
         "statusCode": status_code,
         "headers": get_cors_headers(origin),
-        "body": json.dumps(body)
+        "body": json_dumps(body)
     }
 
 
@@ -53,25 +106,123 @@ def get_client_ip(event: dict) -> str:
     return http.get("sourceIp", "unknown")
 
 
+def now_iso() -> str:
+    """Current UTC time as an ISO 8601 string."""
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
+
 def validate_email(email: str) -> bool:
     """Validate email format."""
-    if not email or len(email) > 254:
+    if not email or len(email) > MAX_EMAIL_LENGTH:
         return False
     return EMAIL_REGEX.match(email) is not None
 
 
+def seed_subscriber_count() -> None:
+    """One-time backfill: initialise the counter from a count of the existing rows.
+
+    if_not_exists keeps whichever seed lands first, so concurrent cold starts are safe.
+    """
+    scan = {
+        "Select": "COUNT",
+        "ConsistentRead": True,
+        "FilterExpression": Attr("email").ne(STATS_KEY["email"])
+    }
+    total = 0
+    while True:
+        result = table.scan(**scan)
+        total += result["Count"]
+        if "LastEvaluatedKey" not in result:
+            break
+        scan["ExclusiveStartKey"] = result["LastEvaluatedKey"]
+
+    table.update_item(
+        Key=STATS_KEY,
+        UpdateExpression="SET #c = if_not_exists(#c, :seed)",
+        ExpressionAttributeNames={"#c": "count"},
+        ExpressionAttributeValues={":seed": total}
+    )
+    logger.info("[Waitlist] Seeded subscriber counter: %s", total)
+
+
+def ensure_subscriber_count() -> None:
+    """Make sure the counter item exists before any write adjusts it."""
+    global _counter_ready
+    if _counter_ready:
+        return
+    if "Item" not in table.get_item(Key=STATS_KEY, ConsistentRead=True):
+        seed_subscriber_count()
+    _counter_ready = True
+
+
+def update_subscriber_count(delta: int) -> None:
+    """Adjust the subscriber counter after a successful Put/Delete.
+
+    Kept out of a transaction with the write so concurrent signups don't conflict
+    on the counter item; a failed update is logged and leaves the count slightly off.
+    """
+    global _counter_ready
+    try:
+        table.update_item(
+            Key=STATS_KEY,
+            UpdateExpression="ADD #c :delta",
+            ConditionExpression="attribute_exists(#c)",
+            ExpressionAttributeNames={"#c": "count"},
+            ExpressionAttributeValues={":delta": delta}
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            # Counter item disappeared: the next write re-seeds it from a fresh count
+            _counter_ready = False
+            return
+        logger.error("DynamoDB counter update error: %s", e)
+
+
+def count_by_source(source: str) -> int:
+    """Count subscribers from one signup source via the source GSI."""
+    query = {
+        "IndexName": SOURCE_INDEX,
+        "KeyConditionExpression": Key("source").eq(source),
+        "Select": "COUNT"
+    }
+    total = 0
+    while True:
+        result = table.query(**query)
+        total += result["Count"]
+        if "LastEvaluatedKey" not in result:
+            return total
+        query["ExclusiveStartKey"] = result["LastEvaluatedKey"]
+
+
 def handle_get_stats(event: dict) -> dict:
-    """GET /waitlist - Return waitlist statistics."""
+    """GET /waitlist[?source=...] - Return waitlist statistics."""
     origin = event.get("headers", {}).get("origin")
+    source = (event.get("queryStringParameters") or {}).get("source")
 
     try:
-        result = table.scan(Select="COUNT")
+        if source:
+            if len(source) > MAX_SOURCE_LENGTH:
+                return response(400, {"detail": "Invalid source"}, origin)
+            return response(200, {
+                "source": source,
+                "total_subscribers": count_by_source(source),
+                "status": "ok"
+            }, origin)
+
+        result = table.get_item(Key=STATS_KEY, ConsistentRead=True)
+        if "Item" in result:
+            total = int(result["Item"].get("count", 0))
+        else:
+            # Counter not initialised yet: fall back to the (periodically refreshed) table item count
+            description = table.meta.client.describe_table(TableName=WAITLIST_TABLE)
+            total = description["Table"]["ItemCount"]
+
         return response(200, {
-            "total_subscribers": result.get("Count", 0),
+            "total_subscribers": total,
             "status": "ok"
         }, origin)
     except ClientError as e:
-        print(f"DynamoDB error: {e}")
+        logger.error("DynamoDB error: %s", e)
         return response(500, {"detail": "Database error"}, origin)
 
 
@@ -79,15 +230,29 @@ def handle_subscribe(event: dict) -> dict:
     """POST /waitlist - Add email to waitlist."""
     origin = event.get("headers", {}).get("origin")
 
+    raw_body = event.get("body") or "{}"
+    if len(raw_body) > MAX_BODY_SIZE:
+        return response(413, {"detail": "Payload too large"}, origin)
+
     try:
-        body = json.loads(event.get("body", "{}"))
-    except json.JSONDecodeError:
+        body = json_loads(raw_body)
+    except json.JSONDecodeError:  # orjson.JSONDecodeError subclasses it
+        return response(400, {"detail": "Invalid JSON body"}, origin)
+    if not isinstance(body, dict):
         return response(400, {"detail": "Invalid JSON body"}, origin)
 
-    email = body.get("email", "").lower().strip()
+    email = body.get("email", "")
+    # Reject oversized or non-string input before normalizing it
+    if not isinstance(email, str) or len(email) > MAX_EMAIL_LENGTH:
+        return response(400, {"detail": "Invalid email address"}, origin)
+    email = email.lower().strip()
     consent = body.get("consent", False)
-    consent_timestamp = body.get("consent_timestamp", datetime.utcnow().isoformat() + "Z")
-    source = body.get("source", "landing_page")
+    now = now_iso()
+    consent_timestamp = body.get("consent_timestamp") or now
+    source = body.get("source") or DEFAULT_SOURCE
+    if not isinstance(source, str) or len(source) > MAX_SOURCE_LENGTH:
+        # source is a GSI key: it must be a short, non-empty string for the write to succeed
+        source = DEFAULT_SOURCE
 
     # Validate email
     if not validate_email(email):
@@ -97,34 +262,32 @@ def handle_subscribe(event: dict) -> dict:
     if not consent:
         return response(400, {"detail": "Consent must be given to join the waitlist"}, origin)
 
-    # Check if email already exists
-    try:
-        existing = table.get_item(Key={"email": email})
-        if "Item" in existing:
-            return response(400, {"detail": "This email is already on the waitlist."}, origin)
-    except ClientError as e:
-        print(f"DynamoDB get error: {e}")
-        return response(500, {"detail": "Database error"}, origin)
-
-    # Add new entry
-    entry_id = str(uuid.uuid4())
+    # Add new entry (the condition rejects emails that are already on the waitlist)
+    entry_id = secrets.token_hex(16)
     client_ip = get_client_ip(event)
 
+    item = {
+        "email": email,
+        "id": entry_id,
+        "consent": consent,
+        "consent_timestamp": consent_timestamp,
+        "source": source,
+        "ip_address": client_ip,
+        "created_at": now
+    }
+
     try:
-        table.put_item(Item={
-            "email": email,
-            "id": entry_id,
-            "consent": consent,
-            "consent_timestamp": consent_timestamp,
-            "source": source,
-            "ip_address": client_ip,
-            "created_at": datetime.utcnow().isoformat() + "Z"
-        })
+        ensure_subscriber_count()
+        table.put_item(Item=item, ConditionExpression="attribute_not_exists(email)")
     except ClientError as e:
-        print(f"DynamoDB put error: {e}")
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return response(400, {"detail": "This email is already on the waitlist."}, origin)
+        logger.error("DynamoDB put error: %s", e)
         return response(500, {"detail": "Failed to save to database"}, origin)
 
-    print(f"[Waitlist] New signup: {email}")
+    update_subscriber_count(1)
+
+    logger.info("[Waitlist] New signup: %s", email)
 
     return response(200, {
         "success": True,
@@ -136,61 +299,91 @@ def handle_subscribe(event: dict) -> dict:
 def handle_unsubscribe(event: dict, email: str) -> dict:
     """DELETE /waitlist/{email} - Remove email from waitlist."""
     origin = event.get("headers", {}).get("origin")
+    if len(email) > MAX_EMAIL_LENGTH:
+        return response(400, {"detail": "Invalid email address"}, origin)
     email = email.lower().strip()
 
     if not validate_email(email):
         return response(400, {"detail": "Invalid email address"}, origin)
 
     try:
-        # Check if exists first
-        existing = table.get_item(Key={"email": email})
-        if "Item" not in existing:
+        ensure_subscriber_count()
+        table.delete_item(
+            Key={"email": email},
+            ConditionExpression="attribute_exists(email)",
+            ReturnValues="NONE"
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
             return response(404, {"detail": "Email not found"}, origin)
+        logger.error("DynamoDB delete error: %s", e)
+        return response(500, {"detail": "Failed to remove from database"}, origin)
 
-        table.delete_item(Key={"email": email})
-        print(f"[Waitlist] Unsubscribed: {email}")
+    update_subscriber_count(-1)
+    logger.info("[Waitlist] Unsubscribed: %s", email)
 
-        return response(200, {
-            "success": True,
-            "message": "Email removed from waitlist"
-        }, origin)
-    except ClientError as e:
-        print(f"DynamoDB delete error: {e}")
-        return response(500, {"detail": "Failed to remove from database"}, origin)
+    return response(200, {
+        "success": True,
+        "message": "Email removed from waitlist"
+    }, origin)
+
+
+# Health check body never changes, so it is serialized once
+HEALTH_BODY = json_dumps({
+    "status": "ok",
+    "service": "terraperf-waitlist"
+})
 
 
 def handle_health(event: dict) -> dict:
     """GET / - Health check."""
     origin = event.get("headers", {}).get("origin")
-    return response(200, {
-        "status": "ok",
-        "service": "terraperf-waitlist"
-    }, origin)
+    return {
+        "statusCode": 200,
+        "headers": get_cors_headers(origin),
+        "body": HEALTH_BODY
+    }
+
+
+# Static routes, keyed by (method, path)
+ROUTES = {
+    ("GET", "/"): handle_health,
+    ("GET", "/waitlist"): handle_get_stats,
+    ("POST", "/waitlist"): handle_subscribe,
+}
+
+# Prefix of the DELETE /waitlist/{email} route
+WAITLIST_PREFIX = "/waitlist/"
+WAITLIST_PREFIX_LEN = len(WAITLIST_PREFIX)
 
 
 def handler(event, context):
     """Lambda handler for API Gateway HTTP API."""
-    print(f"Event: {json.dumps(event)}")
+    logger.debug("Event: %s", event)
 
     request_context = event.get("requestContext", {})
     http = request_context.get("http", {})
     method = http.get("method", "GET")
     path = http.get("path", "/")
+    logger.info("%s %s", method, path)
 
-    # Route requests
-    if path == "/" and method == "GET":
-        return handle_health(event)
-
-    elif path == "/waitlist" and method == "GET":
-        return handle_get_stats(event)
+    # Answer CORS preflight requests without routing
+    if method == "OPTIONS":
+        origin = event.get("headers", {}).get("origin")
+        return {
+            "statusCode": 204,
+            "headers": _PREFLIGHT_HEADERS_BY_ORIGIN.get(origin, _DEFAULT_PREFLIGHT_HEADERS),
+            "body": ""
+        }
 
-    elif path == "/waitlist" and method == "POST":
-        return handle_subscribe(event)
+    # Route requests
+    route = ROUTES.get((method, path))
+    if route:
+        return route(event)
 
-    elif path.startswith("/waitlist/") and method == "DELETE":
-        email = path.replace("/waitlist/", "")
+    if method == "DELETE" and path.startswith(WAITLIST_PREFIX):
+        email = path[WAITLIST_PREFIX_LEN:]
         return handle_unsubscribe(event, email)
 
-    else:
-        origin = event.get("headers", {}).get("origin")
-        return response(404, {"detail": "Not found"}, origin)
+    origin = event.get("headers", {}).get("origin")
+    return response(404, {"detail": "Not found"}, origin)
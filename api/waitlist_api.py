@@ -2,40 +2,78 @@
 """
 TerraPerf Waitlist API
 Simple backend for collecting email signups.
-- Local: Stores in JSON file
-- Production: Uses DynamoDB
+- Local: Stores in a JSON Lines file
+- Production: Uses DynamoDB (the deployed Lambda is api/lambda/lambda_handler.py)
 """
 
-import json
+import asyncio
+import logging
 import os
 import re
-import uuid
-from datetime import datetime
+import secrets
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Optional
 
+import orjson
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr, field_validator
+from pydantic import BaseModel, field_validator
 
 # Configuration
 IS_LOCAL = os.getenv("AWS_LAMBDA_FUNCTION_NAME") is None
 DATA_DIR = Path(__file__).parent / "data"
-WAITLIST_FILE = DATA_DIR / "waitlist.json"
+WAITLIST_FILE = DATA_DIR / "waitlist.jsonl"
+LEGACY_WAITLIST_FILE = DATA_DIR / "waitlist.json"  # JSON array format used before waitlist.jsonl
+
+# Email validation (same rules as the Lambda handler)
+MAX_EMAIL_LENGTH = 254
+EMAIL_REGEX = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+
+# source is the partition key of the table's source GSI (capped at 2048 bytes)
+DEFAULT_SOURCE = "landing_page"
+MAX_SOURCE_LENGTH = 64
+
+# Lambda attaches a handler to the root logger; locally (incl. `uvicorn waitlist_api:app`) add one here
+if IS_LOCAL:
+    logging.basicConfig(format="%(levelname)s:     %(message)s")
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+
+if not IS_LOCAL:
+    # Production mode: async DynamoDB client so requests don't block the event loop
+    import aioboto3
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+
+    AWS_REGION = os.getenv("AWS_REGION", "eu-west-1")
+    DYNAMODB_ENDPOINT = f"https://dynamodb.{AWS_REGION}.amazonaws.com"
+    WAITLIST_TABLE = os.getenv("WAITLIST_TABLE", "terraperf-landing-waitlist-prod")
+    BOTO_CONFIG = Config(region_name=AWS_REGION, tcp_keepalive=True, max_pool_connections=10)
+
+    _session = aioboto3.Session()
+
+# DynamoDB table resource, opened on first use and kept for the container's lifetime
+_resources = AsyncExitStack()
+_table = None
+_table_lock = asyncio.Lock()
 
 app = FastAPI(title="TerraPerf Waitlist API", version="1.0.0")
 
 # CORS configuration
+ALLOWED_ORIGINS = frozenset({
+    "http://localhost:8080",
+    "http://localhost:8083",
+    "http://127.0.0.1:8080",
+    "http://127.0.0.1:8083",
+    "https://terraperf.com",
+    "https://www.terraperf.com",
+})
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        "http://localhost:8080",
-        "http://localhost:8083",
-        "http://127.0.0.1:8080",
-        "http://127.0.0.1:8083",
-        "https://terraperf.com",
-        "https://www.terraperf.com",
-    ],
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS"],
     allow_headers=["*"],
@@ -43,10 +81,27 @@ app.add_middleware(
 
 
 class WaitlistEntry(BaseModel):
-    email: EmailStr
+    email: str
     consent: bool
     consent_timestamp: str
-    source: Optional[str] = "landing_page"
+    source: Optional[str] = DEFAULT_SOURCE
+
+    @field_validator("email")
+    @classmethod
+    def email_must_be_valid(cls, v):
+        if len(v) > MAX_EMAIL_LENGTH:
+            raise ValueError("Invalid email address")
+        v = v.strip().lower()
+        if not EMAIL_REGEX.match(v):
+            raise ValueError("Invalid email address")
+        return v
+
+    @field_validator("source")
+    @classmethod
+    def source_must_be_short(cls, v):
+        if not v or len(v) > MAX_SOURCE_LENGTH:
+            return DEFAULT_SOURCE
+        return v
 
     @field_validator("consent")
     @classmethod
@@ -62,34 +117,111 @@ class WaitlistResponse(BaseModel):
     id: Optional[str] = None
 
 
-def load_waitlist() -> list:
-    """Load waitlist from JSON file (local mode only)."""
-    if not IS_LOCAL:
+def read_waitlist_lines() -> list:
+    """Read (raw line, entry) pairs from JSON Lines file; entry is None if unusable (local mode only)."""
+    if not IS_LOCAL or not WAITLIST_FILE.exists():
         return []
 
-    if not WAITLIST_FILE.exists():
-        DATA_DIR.mkdir(parents=True, exist_ok=True)
-        WAITLIST_FILE.write_text("[]")
-        return []
+    lines = []
+    with WAITLIST_FILE.open("rb") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                entry = None
+            if not isinstance(entry, dict) or not isinstance(entry.get("email"), str):
+                logger.warning("Skipping invalid line %d in %s", number, WAITLIST_FILE)
+                entry = None
+            lines.append((line, entry))
+    return lines
 
-    try:
-        return json.loads(WAITLIST_FILE.read_text())
-    except json.JSONDecodeError:
-        return []
+
+def load_waitlist() -> list:
+    """Load waitlist from JSON Lines file (local mode only)."""
+    return [entry for _, entry in read_waitlist_lines() if entry is not None]
+
+
+def append_entry(entry: dict) -> None:
+    """Append one entry to the JSON Lines file (local mode only)."""
+    if not IS_LOCAL:
+        return
+
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    with WAITLIST_FILE.open("ab") as f:
+        f.write(orjson.dumps(entry) + b"\n")
 
 
 def save_waitlist(entries: list) -> None:
-    """Save waitlist to JSON file (local mode only)."""
+    """Rewrite the whole JSON Lines file (local mode only)."""
     if not IS_LOCAL:
         return
 
     DATA_DIR.mkdir(parents=True, exist_ok=True)
-    WAITLIST_FILE.write_text(json.dumps(entries, indent=2))
+    WAITLIST_FILE.write_bytes(b"".join(orjson.dumps(e) + b"\n" for e in entries))
+
+
+def remove_from_waitlist(email: str) -> None:
+    """Rewrite the JSON Lines file without an email, keeping unparseable lines as-is (local mode only)."""
+    if not IS_LOCAL:
+        return
+
+    kept = [
+        line if line.endswith(b"\n") else line + b"\n"
+        for line, entry in read_waitlist_lines()
+        if entry is None or entry["email"].lower() != email
+    ]
+    WAITLIST_FILE.write_bytes(b"".join(kept))
+
+
+def migrate_legacy_waitlist() -> None:
+    """Convert the old waitlist.json array into waitlist.jsonl once (local mode only)."""
+    if not IS_LOCAL or WAITLIST_FILE.exists() or not LEGACY_WAITLIST_FILE.exists():
+        return
+
+    try:
+        entries = orjson.loads(LEGACY_WAITLIST_FILE.read_bytes())
+    except orjson.JSONDecodeError:
+        entries = None
+    if not isinstance(entries, list):
+        logger.warning("Could not parse %s, not migrating it", LEGACY_WAITLIST_FILE)
+        return
+
+    save_waitlist(entries)
+    logger.info("Migrated %d entries from %s to %s", len(entries), LEGACY_WAITLIST_FILE, WAITLIST_FILE)
+
+
+migrate_legacy_waitlist()
+
+# Emails on the local waitlist, loaded once so duplicate checks don't re-read the file
+_emails = {e["email"].lower() for e in load_waitlist()}
 
 
-def email_exists(email: str, entries: list) -> bool:
+def email_exists(email: str) -> bool:
     """Check if email already exists in waitlist."""
-    return any(e.get("email", "").lower() == email.lower() for e in entries)
+    return email in _emails
+
+
+def now_iso() -> str:
+    """Current UTC time as an ISO 8601 string."""
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
+
+async def get_table():
+    """Get the shared DynamoDB table resource (production mode only)."""
+    global _table
+    if _table is None:
+        async with _table_lock:
+            # Re-check: another request may have opened it while we waited
+            if _table is None:
+                dynamodb = await _resources.enter_async_context(_session.resource(
+                    "dynamodb",
+                    endpoint_url=DYNAMODB_ENDPOINT,
+                    config=BOTO_CONFIG,
+                ))
+                _table = await dynamodb.Table(WAITLIST_TABLE)
+    return _table
 
 
 def get_client_ip(request: Request) -> str:
@@ -109,9 +241,8 @@ async def root():
 @app.get("/waitlist")
 async def get_waitlist_stats():
     """Get waitlist statistics (for admin use)."""
-    entries = load_waitlist()
     return {
-        "total_subscribers": len(entries),
+        "total_subscribers": len(_emails),
         "is_local": IS_LOCAL
     }
 
@@ -119,34 +250,30 @@ async def get_waitlist_stats():
 @app.post("/waitlist", response_model=WaitlistResponse)
 async def subscribe(entry: WaitlistEntry, request: Request):
     """Add email to the waitlist."""
-
-    # Normalize email
-    email = entry.email.lower().strip()
+    email = entry.email  # Normalized by WaitlistEntry
 
     if IS_LOCAL:
-        # Local mode: Store in JSON file
-        entries = load_waitlist()
-
-        if email_exists(email, entries):
+        # Local mode: Append to JSON Lines file
+        if email_exists(email):
             raise HTTPException(
                 status_code=400,
                 detail="This email is already on the waitlist."
             )
 
         new_entry = {
-            "id": str(uuid.uuid4()),
+            "id": secrets.token_hex(16),
             "email": email,
             "consent": entry.consent,
             "consent_timestamp": entry.consent_timestamp,
             "source": entry.source,
             "ip_address": get_client_ip(request),
-            "created_at": datetime.utcnow().isoformat() + "Z"
+            "created_at": now_iso()
         }
 
-        entries.append(new_entry)
-        save_waitlist(entries)
+        append_entry(new_entry)
+        _emails.add(email)
 
-        print(f"[Waitlist] New signup: {email}")
+        logger.info("[Waitlist] New signup: %s", email)
 
         return WaitlistResponse(
             success=True,
@@ -156,37 +283,25 @@ async def subscribe(entry: WaitlistEntry, request: Request):
 
     else:
         # Production mode: Use DynamoDB
-        import boto3
-        from botocore.exceptions import ClientError
-
-        dynamodb = boto3.resource("dynamodb", region_name=os.getenv("AWS_REGION", "eu-west-1"))
-        table = dynamodb.Table(os.getenv("WAITLIST_TABLE", "terraperf-waitlist-prod"))
-
-        # Check if email exists
+        # Add new entry (the condition rejects emails that are already on the waitlist)
+        entry_id = secrets.token_hex(16)
         try:
-            response = table.get_item(Key={"email": email})
-            if "Item" in response:
-                raise HTTPException(
-                    status_code=400,
-                    detail="This email is already on the waitlist."
-                )
-        except ClientError as e:
-            if e.response["Error"]["Code"] != "ResourceNotFoundException":
-                raise HTTPException(status_code=500, detail="Database error")
-
-        # Add new entry
-        entry_id = str(uuid.uuid4())
-        try:
-            table.put_item(Item={
+            table = await get_table()
+            await table.put_item(Item={
                 "id": entry_id,
                 "email": email,
                 "consent": entry.consent,
                 "consent_timestamp": entry.consent_timestamp,
                 "source": entry.source,
                 "ip_address": get_client_ip(request),
-                "created_at": datetime.utcnow().isoformat() + "Z"
-            })
+                "created_at": now_iso()
+            }, ConditionExpression="attribute_not_exists(email)")
         except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise HTTPException(
+                    status_code=400,
+                    detail="This email is already on the waitlist."
+                )
             raise HTTPException(status_code=500, detail="Failed to save to database")
 
         return WaitlistResponse(
@@ -199,34 +314,37 @@ async def subscribe(entry: WaitlistEntry, request: Request):
 @app.delete("/waitlist/{email}")
 async def unsubscribe(email: str):
     """Remove email from the waitlist (for GDPR compliance)."""
+    if len(email) > MAX_EMAIL_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid email address")
     email = email.lower().strip()
+    if not EMAIL_REGEX.match(email):
+        raise HTTPException(status_code=400, detail="Invalid email address")
 
     if IS_LOCAL:
-        entries = load_waitlist()
-        original_count = len(entries)
-        entries = [e for e in entries if e.get("email", "").lower() != email]
-
-        if len(entries) == original_count:
+        if not email_exists(email):
             raise HTTPException(status_code=404, detail="Email not found")
 
-        save_waitlist(entries)
+        # Rewrite the file so the entry is actually erased (no tombstones for GDPR removals)
+        remove_from_waitlist(email)
+        _emails.discard(email)
         return {"success": True, "message": "Email removed from waitlist"}
 
     else:
-        import boto3
-        from botocore.exceptions import ClientError
-
-        dynamodb = boto3.resource("dynamodb", region_name=os.getenv("AWS_REGION", "eu-west-1"))
-        table = dynamodb.Table(os.getenv("WAITLIST_TABLE", "terraperf-waitlist-prod"))
-
         try:
-            table.delete_item(Key={"email": email})
+            table = await get_table()
+            await table.delete_item(
+                Key={"email": email},
+                ConditionExpression="attribute_exists(email)",
+                ReturnValues="NONE"
+            )
             return {"success": True, "message": "Email removed from waitlist"}
-        except ClientError:
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise HTTPException(status_code=404, detail="Email not found")
             raise HTTPException(status_code=500, detail="Failed to remove from database")
 
 
 if __name__ == "__main__":
     import uvicorn
-    print("Starting TerraPerf Waitlist API on http://localhost:8001")
+    logger.info("Starting TerraPerf Waitlist API on http://localhost:8001")
     uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -12,6 +12,24 @@ resource "aws_dynamodb_table" "waitlist" {
     type = "S"
   }
 
+  attribute {
+    name = "source"
+    type = "S"
+  }
+
+  attribute {
+    name = "created_at"
+    type = "S"
+  }
+
+  # Per-source analytics (counts, latest signups) without scanning the table
+  global_secondary_index {
+    name            = "source-created_at-index"
+    hash_key        = "source"
+    range_key       = "created_at"
+    projection_type = "KEYS_ONLY"
+  }
+
   tags = {
     Name        = "TerraPerf Waitlist"
     Environment = var.environment
@@ -66,9 +84,18 @@ resource "aws_iam_role_policy" "waitlist_lambda" {
           "dynamodb:GetItem",
           "dynamodb:PutItem",
           "dynamodb:DeleteItem",
-          "dynamodb:Scan"
+          "dynamodb:UpdateItem",
+          "dynamodb:Scan",
+          "dynamodb:DescribeTable"
         ]
         Resource = aws_dynamodb_table.waitlist.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:Query"
+        ]
+        Resource = "${aws_dynamodb_table.waitlist.arn}/index/*"
       }
     ]
   })
@@ -129,7 +156,7 @@ resource "aws_apigatewayv2_api" "waitlist" {
     allow_origins = ["https://terraperf.com", "https://www.terraperf.com"]
     allow_methods = ["GET", "POST", "DELETE", "OPTIONS"]
     allow_headers = ["Content-Type", "Authorization"]
-    max_age       = 300
+    max_age       = 86400
   }
 
   tags = {